@@ -45,11 +45,12 @@
     SOFTWARE.
 
 """
-import inspect
-import importlib
 import gevent
-from six.moves import reload_module
-from dogma.program import Program, PlugableProgram, ProgramLoadError
+from dogma.program import Program, PlugableProgram, ProgramLoadError, import_class
+
+
+SHUTDOWN_TIMEOUT = 10
+_MISSING = object()
 
 
 class Agent(object):
@@ -70,6 +71,7 @@ class Agent(object):
 
     def __init__(self):
         self.programs = {}
+        self._programs_tuple = ()
 
 
     def program_import(self, module, unique_id=None, classname="Program", config=None, plugins=None):
@@ -100,18 +102,7 @@ class Agent(object):
 
         """
         unique_id = unique_id or module
-        mod = importlib.import_module(module)
-        program = getattr(mod, classname)
-
-        if not program:
-            raise ProgramLoadError("Class %s for module %s not defined" % (classname, module))
-
-        if not inspect.isclass(program):
-            raise ProgramLoadError("Attribute %s for module %s is not a class" % (classname, module))
-
-        if program == Program:
-            raise ProgramLoadError("Class %s for module %s can not be dogma.program.Program" % (classname, module))
-
+        program = import_class(module, classname, Program)
         return self.program_load(program, unique_id, config=config, plugins=plugins)
 
 
@@ -119,7 +110,7 @@ class Agent(object):
     def program_load(self, program, unique_id, config=None, state=None, plugins=None):
         """
         Instances a Program subclass object and calls its .load() method.
-        Called automatically with Agent.program_new() after module import, and on program reload.
+        Called automatically with Agent.program_import() after module import, and on program reload.
 
         Parameters
         ----------
@@ -146,16 +137,17 @@ class Agent(object):
 
         """
         if unique_id in self.programs:
-            raise ProgramLoadError("Program already loaded: %s" % unique_id)
+            raise ProgramLoadError(f"Program already loaded: {unique_id}")
 
-        if inspect.isclass(program):
+        if isinstance(program, type):
             program = program(self)
 
         program.unique_id = unique_id
         self.programs[unique_id] = program
+        self._programs_tuple = tuple(self.programs.values())
         program.load(config=config, state=state or {})
 
-        if hasattr(program, 'plugin_import_list'):
+        if isinstance(program, PlugableProgram):
             program.plugin_import_list(plugins)
 
         return program
@@ -180,13 +172,12 @@ class Agent(object):
         dogma.program.ProgramLoadError
 
         """
+        program = self.programs.pop(unique_id, _MISSING)
+        if program is _MISSING:
+            raise ProgramLoadError(f"Cannot remove non-loaded program: {unique_id}")
 
-        if unique_id is None or unique_id not in self.programs:
-            raise ProgramLoadError("Cannot remove non-loaded program: %s" % unique_id)
-
-        state = self.programs[unique_id].unload({})
-        del self.programs[unique_id]
-        return state
+        self._programs_tuple = tuple(self.programs.values())
+        return program.unload(None)
 
 
     def program_reload(self, unique_id, config=None):
@@ -213,16 +204,14 @@ class Agent(object):
 
         """
         if unique_id is None or unique_id not in self.programs:
-            raise ProgramLoadError("Cannot reload non-loaded program: %s" % unique_id)
+            raise ProgramLoadError(f"Cannot reload non-loaded program: {unique_id}")
 
         program = self.programs[unique_id]
         if config is None:
             config = program.config
         state = self.program_unload(unique_id)
-        reload_module(inspect.getmodule(program))
-
         program = self.program_load(
-            program.__class__,
+            program.reload_class(force=True),
             unique_id,
             config=config,
             state=state,
@@ -237,19 +226,62 @@ class Agent(object):
         Initializes all loaded Program subclass instances, calling each one's .init() method and
         waits until all greenlets are finished.
         """
-        for program in self.programs.values():
+        for program in self._programs_tuple:
             program.init()
-        gevent.joinall([x.green for x in self.programs.values()])
 
+        # skip missing, dead, raw or duplicate greenlets, joinall misbehaves on those.
+        seen = set()
+        greens = []
+        for program in self._programs_tuple:
+            green = program.joinable_green()
+            if green is None or id(green) in seen:
+                continue
+            seen.add(id(green))
+            greens.append(green)
+        gevent.joinall(greens, raise_error=False)
 
-    def shutdown(self):
+
+    def shutdown(self, timeout=SHUTDOWN_TIMEOUT):
         """
-        Unloads all programs and plugins and ends the agents run loop
+        Unloads all programs and plugins and ends the agents run loop.
+        Programs are unloaded concurrently, each in its own greenlet.
+
+        Parameters
+        ----------
+        timeout : Optional[float]
+            seconds to wait for all unloads to finish. None waits forever.
+            Unloads still running when the timeout expires are killed.
+
+        Raises
+        ----------
+        dogma.program.ProgramLoadError
+            after all unloads finished or were killed, if any unload raised an
+            exception or did not finish in time. Its `errors` attribute holds
+            the unique id and exception of each failed program.
         """
-        for program in [x for x in self.programs.keys()]:
-            self.program_unload(program)
+        # start killing run greenlets now so teardown overlaps the unloads
+        for program in self._programs_tuple:
+            green = program.joinable_green()
+            if green is not None:
+                green.kill(block=False)
+
+        jobs = [(name, gevent.spawn(self.program_unload, name)) for name in list(self.programs)]
+        gevent.joinall([job for _, job in jobs], timeout=timeout, raise_error=False)
+
+        errors = []
+        pending = []
+        for name, job in jobs:
+            if not job.ready():
+                pending.append(job)
+                errors.append((name, ProgramLoadError(f"Unload did not finish within {timeout} seconds")))
+            elif job.exception is not None:
+                errors.append((name, job.exception))
+        if pending:
+            gevent.killall(pending, block=False)
+        if errors:
+            raise ProgramLoadError.aggregate("Failed to unload programs", errors) from errors[0][1]
 
 
     def propogate(self, command, data):
-        for program in self.programs:
+        for program in self._programs_tuple:
             program.propogate(command, data)
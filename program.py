@@ -46,17 +46,122 @@
     SOFTWARE.
 
 """
+import os
+import sys
 import importlib
-import inspect
 import gevent
-from six.moves import reload_module
+from importlib import reload as reload_module
+
+
+_MISSING = object()
+_module_mtimes = {}
+
+
+def _module_mtime(module):
+    """
+    Returns a (mtime, size) stamp for a module's source file, or None if it has
+    no file on disk.
+    """
+    path = getattr(module, "__file__", None)
+    if path is None:
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _cached_module(module_name):
+    """
+    Returns module `module_name`, importing it only if it is not already (fully)
+    present in sys.modules. Import errors are raised as ProgramLoadError.
+    """
+    modules = sys.modules
+    if module_name not in modules or (
+            getattr(modules[module_name], "__spec__", None) is not None and
+            getattr(modules[module_name].__spec__, "_initializing", False)):
+        try:
+            importlib.import_module(module_name)
+        except ImportError as err:
+            raise ProgramLoadError(f"Failed to import module {module_name}: {err}") from err
+        _module_mtimes[module_name] = _module_mtime(modules[module_name])
+    return modules[module_name]
+
+
+def _cached_import(module_name, item_name):
+    """
+    Returns attribute `item_name` of module `module_name`, see _cached_module().
+    """
+    return getattr(_cached_module(module_name), item_name)
+
+
+def reload_if_changed(module_name, force=False):
+    """
+    Reloads and returns module `module_name` from sys.modules. Unless `force` is
+    True, the reload is skipped if the module's source file is unchanged since
+    it was last imported or reloaded, in which case the module is returned as is.
+    """
+    module = sys.modules[module_name]
+    mtime = _module_mtime(module)
+    if force or mtime is None or _module_mtimes.get(module_name) != mtime:
+        importlib.invalidate_caches()
+        module = reload_module(module)
+        _module_mtimes[module_name] = mtime
+    return module
 
 
 class ProgramLoadError(Exception):
-    def __init__(self, value):
-        self.parameter = value
-    def __str__(self):
-        return repr(self.parameter)
+    """
+    Raised when a program or plugin can not be imported, loaded, unloaded or reloaded.
+
+    Attributes
+    ----------
+    errors : list(tuple(str, Exception))
+        for errors covering several programs or plugins, the unique id and
+        exception of each one that failed. Empty otherwise.
+    """
+    errors = ()
+
+    @classmethod
+    def aggregate(cls, message, errors):
+        """
+        Returns a ProgramLoadError for several failed programs or plugins.
+
+        Parameters
+        ----------
+        message : str
+            summary message, the unique id and error of each failure are appended.
+        errors : list(tuple(str, Exception))
+            unique id and exception of each program or plugin that failed.
+        """
+        failed = ", ".join(f"{unique_id} ({type(err).__name__}: {err})" for unique_id, err in errors)
+        error = cls(f"{message}: {failed}")
+        error.errors = errors
+        return error
+
+
+def import_class(module, classname, base):
+    """
+    Imports and returns class `classname` from `module`, checking that it can be
+    loaded in place of `base` (dogma.program.Program or dogma.program.Plugin).
+
+    Raises
+    ----------
+    dogma.program.ProgramLoadError
+    """
+    cls = _cached_import(module, classname)
+
+    if not cls:
+        raise ProgramLoadError(f"Class {classname} for module {module} not defined")
+
+    if not isinstance(cls, type):
+        raise ProgramLoadError(f"Attribute {classname} for module {module} is not a class")
+
+    if cls == base:
+        raise ProgramLoadError(f"Class {classname} for module {module} can not be dogma.program.{base.__name__}")
+
+    return cls
 
 
 class Plugin(object):
@@ -67,16 +172,22 @@ class Plugin(object):
     ----------
     parent : dogma.program.Program
         The object instance of a Program subclass that this plugin is attached to.
+    agent : dogma.Agent
+        The agent of this plugin's parent program.
     config : Object
         abstract configuration object placeholder.
     unique_id : str
         unique string identifier assigned to this plugin
     """
-    config = None
-    unique_id = None
+    __slots__ = ('parent', 'agent', 'config', 'unique_id', '_name', '_module_name')
 
     def __init__(self, parent):
         self.parent = parent
+        self.agent = parent.agent
+        self.config = None
+        self.unique_id = None
+        self._name = type(self).__name__
+        self._module_name = type(self).__module__
 
 
     def load(self, config=None, state=None):
@@ -119,6 +230,25 @@ class Plugin(object):
         pass
 
 
+    def reload_class(self, force=False):
+        """
+        Reloads the module this plugin's class is defined in, and returns the class
+        of the same name from it. Called by PlugableProgram.plugin_reload() after this
+        instance is unloaded.
+
+        Parameters
+        ----------
+        force : Optional[bool]
+            re-execute the module even if its source file is unchanged, see
+            dogma.program.reload_if_changed()
+
+        Returns
+        ----------
+        type
+        """
+        return getattr(reload_if_changed(self._module_name, force), self._name)
+
+
     def sibling(self, unique_id):
         """
         Returns a sibling plugin: another plugin loaded by this program.
@@ -151,18 +281,7 @@ class Plugin(object):
         dogma.program.Program | None
             A subclass instance
         """
-        return self.parent.agent.programs.get(unique_id)
-
-
-    def agent(self):
-        """
-        Returns the agent of this plugins parent program.
-
-        Returns
-        ----------
-        dogma.Agent
-        """
-        return self.parent.agent
+        return self.agent.programs.get(unique_id)
 
 
     def propogate(self, command, data):
@@ -171,13 +290,35 @@ class Plugin(object):
 
 class Program(object):
     """
-        Class representing a Dogma Program.
+    Class representing a Dogma Program.
+
+    Attributes
+    ----------
+    agent : dogma.Agent
+        The agent this program is loaded by.
+    config : Object
+        abstract configuration object placeholder.
+    unique_id : str
+        unique string identifier assigned to this program
+    green : gevent.Greenlet | greenlet.greenlet | None
+        the greenlet running run(), None until init() spawns it. A link callback
+        resets it to None once run() finishes (not for raw greenlets).
+    _raw_greenlet : bool
+        if True, run() is started with gevent.spawn_raw() instead of
+        gevent.spawn(). This skips the Greenlet wrapper, so self.green has no
+        link()/join()/get() and the program is not waited on by Agent.init().
+        Defaults to False.
     """
+    __slots__ = ('agent', 'config', 'unique_id', 'green', '_name', '_module_name')
+    _raw_greenlet = False
+
     def __init__(self, agent):
         self.agent = agent
         self.config = None
         self.unique_id = None
         self.green = None
+        self._name = type(self).__name__
+        self._module_name = type(self).__module__
 
 
     def load(self, config=None, state=None):
@@ -194,8 +335,12 @@ class Program(object):
         """
         if state is None:
             state = {}
-        if self.green and not self.green.dead:
-            self.green.kill()
+        green = self.green
+        if green is not None:
+            if not self._raw_greenlet:
+                green.kill()
+            elif not green.dead:
+                gevent.kill(green)
         return state
 
 
@@ -204,14 +349,67 @@ class Program(object):
         Called when initializing the program. Your Program subclass needs to call
         Program.init() at the start (or end) of your subclass.init() method
         (your choice, but remember calling Program.init will spawn our run greenlet)
+        If run() is not overridden, no greenlet is spawned and self.green is None.
+        """
+        if type(self).run is Program.run:
+            self.green = None
+            return
+
+        if self._raw_greenlet:
+            self.green = gevent.spawn_raw(self.run)
+        else:
+            self.green = gevent.spawn(self.run)
+            self.green.link(self._green_done)
+
+
+    def reload_class(self, force=False):
+        """
+        Reloads the module this program's class is defined in, and returns the class
+        of the same name from it. Called by Agent.program_reload() after this
+        instance is unloaded.
+
+        Parameters
+        ----------
+        force : Optional[bool]
+            re-execute the module even if its source file is unchanged, see
+            dogma.program.reload_if_changed()
+
+        Returns
+        ----------
+        type
+        """
+        return getattr(reload_if_changed(self._module_name, force), self._name)
+
+
+    def joinable_green(self):
+        """
+        Returns our run greenlet if it is still running and can be joined or
+        killed without blocking, otherwise None. Raw greenlets (see
+        _raw_greenlet) are never returned.
+
+        Returns
+        ----------
+        gevent.Greenlet | None
         """
-        self.green = gevent.spawn(self.run)
+        green = self.green
+        if green is None or green.dead or self._raw_greenlet:
+            return None
+        return green
+
+
+    def _green_done(self, green):
+        """
+        Link callback for our run greenlet, clears self.green once it has finished.
+        """
+        if self.green is green:
+            self.green = None
 
 
     def run(self):
         """
-        This method MUST be overwriten by your subclass or a NotImplementedError
-        is raised. All code in this method is run in a sepeate greenlet.
+        Override this method in your subclass. All code in this method is run in
+        a sepeate greenlet. Programs that don't override it (ie: a PlugableProgram
+        that only hosts plugins) don't get a greenlet.
         """
         raise NotImplementedError()
 
@@ -225,9 +423,13 @@ class PlugableProgram(Program):
     Class representing a Dogma Program, capable of loading plugins. A subclass of
     dogma.programs.Program.
     """
+    __slots__ = ('plugins', '_plugins_tuple', '_plugin_inits')
+
     def __init__(self, agent):
         super().__init__(agent)
         self.plugins = {}
+        self._plugins_tuple = ()
+        self._plugin_inits = ()
 
 
     def load(self, config=None, state=None):
@@ -242,17 +444,34 @@ class PlugableProgram(Program):
         Unloads the PlugableProgram from the agent. Any plugins loaded by
         this program also have their unload() methods triggered. This also
         kills this PlugableProgram's greenlet
+
+        Plugins whose unload() raised stay in self.plugins, and a
+        ProgramLoadError listing them is raised after the greenlet is killed.
         """
         if state is None:
             state = {}
-        state['plugins'] = state.get('plugins', {})
-
-        for name, plugin in self.plugins.items():
-            state['plugins'][name] = plugin.unload({})
-
-        if self.green and not self.green.dead:
-            self.green.kill()
-
+        errors = []
+        if self.plugins:
+            plugins_state = state.setdefault('plugins', {})
+            failed = {}
+            try:
+                while self.plugins:
+                    name, plugin = self.plugins.popitem()
+                    try:
+                        plugins_state[name] = plugin.unload(None)
+                    except Exception as err:
+                        failed[name] = plugin
+                        errors.append((name, err))
+                    except BaseException:
+                        failed[name] = plugin
+                        raise
+            finally:
+                self.plugins.update(failed)
+                self._plugins_changed()
+
+        state = super().unload(state)
+        if errors:
+            raise ProgramLoadError.aggregate("Failed to unload plugins", errors) from errors[0][1]
         return state
 
 
@@ -264,24 +483,63 @@ class PlugableProgram(Program):
         (your choice, but remember calling PlugableProgram.init will spawn our run
          greenlet)
         """
-        for plugin in self.plugins.values():
-            plugin.init()
+        for init in self._plugin_inits:
+            init()
         super().init()
 
 
-    def run(self):
+    def _plugins_changed(self):
         """
-        This method MUST be overwriten by your subclass or a NotImplementedError
-        is raised. All code in this method is run in a sepeate greenlet.
+        Rebuilds the cached plugin tuples, called whenever self.plugins changes.
+        Plugins that don't override Plugin.init() are left out of _plugin_inits.
         """
-        super().run()
+        plugins = tuple(self.plugins.values())
+        self._plugins_tuple = plugins
+        self._plugin_inits = tuple(
+            plugin.init for plugin in plugins if type(plugin).init is not Plugin.init)
 
 
     def plugin_import_list(self, plugins):
+        """
+        Imports and loads a list of plugins with PlugableProgram.plugin_import().
+        All plugin modules are imported before any plugin is loaded, and a
+        failing plugin does not stop the rest.
+
+        Parameters
+        ----------
+        plugins : Optional[list(dict)]
+            list of keyword argument dicts for PlugableProgram.plugin_import()
+
+        Raises
+        ----------
+        dogma.program.ProgramLoadError
+            after all other plugins are loaded, if any plugin failed to import or
+            load (including invalid keyword arguments). Its `errors` attribute
+            holds the unique id and exception of each failed plugin.
+        """
         if not plugins:
             return
+
+        errors = []
+        pending = []
         for kwargs in plugins:
-            self.plugin_import(**kwargs)
+            unique_id = kwargs.get('unique_id') or kwargs.get('module')
+            if 'module' in kwargs:
+                try:
+                    _cached_module(kwargs['module'])
+                except Exception as err:
+                    errors.append((unique_id, err))
+                    continue
+            pending.append((unique_id, kwargs))
+
+        for unique_id, kwargs in pending:
+            try:
+                self.plugin_import(**kwargs)
+            except Exception as err:
+                errors.append((unique_id, err))
+
+        if errors:
+            raise ProgramLoadError.aggregate("Failed to load plugins", errors) from errors[0][1]
 
 
     def plugin_import(self, module, unique_id=None, classname="Plugin", config=None):
@@ -289,18 +547,7 @@ class PlugableProgram(Program):
         Adds and loads a plugin (or plugins), based on module path
         """
         unique_id = unique_id or module
-        mod = importlib.import_module(module)
-        plugin = getattr(mod, classname)
-
-        if not plugin:
-            raise ProgramLoadError("Class %s for module %s not defined" % (classname, module))
-
-        if not inspect.isclass(plugin):
-            raise ProgramLoadError("Attribute %s for module %s is not a class" % (classname, module))
-
-        if plugin == Plugin:
-            raise ProgramLoadError("Class %s for module %s can not be dogma.program.Plugin" % (classname, module))
-
+        plugin = import_class(module, classname, Plugin)
         return self.plugin_load(plugin, unique_id, config=config)
 
 
@@ -309,13 +556,14 @@ class PlugableProgram(Program):
         Loads a plugin.
         """
         if unique_id in self.plugins:
-            raise ProgramLoadError("Plugin already loaded: %s" % unique_id)
+            raise ProgramLoadError(f"Plugin already loaded: {unique_id}")
 
-        if inspect.isclass(plugin):
+        if isinstance(plugin, type):
             plugin = plugin(self)
 
         plugin.unique_id = unique_id
         self.plugins[unique_id] = plugin
+        self._plugins_changed()
         plugin.load(config=config, state=state or {})
         return plugin
 
@@ -324,30 +572,30 @@ class PlugableProgram(Program):
         """
         Unloads and removes a plugin.
         """
-        if unique_id is None or unique_id not in self.plugins:
-            raise ProgramLoadError("Cannot remove non-loaded plugin: %s" % unique_id)
+        plugin = self.plugins.pop(unique_id, _MISSING)
+        if plugin is _MISSING:
+            raise ProgramLoadError(f"Cannot remove non-loaded plugin: {unique_id}")
 
-        state = self.plugins[unique_id].unload({})
-        del self.plugins[unique_id]
-        return state
+        self._plugins_changed()
+        return plugin.unload(None)
 
 
-    def plugin_reload(self, unique_id, config=None):
+    def plugin_reload(self, unique_id, config=None, force=False):
         """
-        Reloads a plugin.
+        Reloads a plugin. The plugin's module is only re-executed if its source
+        file changed since it was last loaded, or if `force` is True (ie: to reset
+        module level state, or pick up changes in modules it imports).
         """
 
         if unique_id is None or unique_id not in self.plugins:
-            raise ProgramLoadError("Cannot reload non-loaded plugin: %s" % unique_id)
+            raise ProgramLoadError(f"Cannot reload non-loaded plugin: {unique_id}")
 
         plugin = self.plugins[unique_id]
         if config is None:
             config = plugin.config
         state = self.plugin_unload(unique_id)
-        reload_module(inspect.getmodule(plugin))
-
         plugin = self.plugin_load(
-            plugin.__class__,
+            plugin.reload_class(force),
             unique_id,
             config=config,
             state=state
@@ -358,5 +606,5 @@ class PlugableProgram(Program):
 
 
     def propogate(self, command, data):
-        for plugin in self.plugins:
+        for plugin in self._plugins_tuple:
             plugin.propogate(command, data)